@@ -11,7 +11,7 @@ import numpy as np
 import random, os
 from psychopy.tools.colorspacetools import hsv2rgb # useful function for converting color space
 from datetime import datetime
-from extras import LAB2RGB # load function from extras.py
+from extras import LAB2RGB, Telemetry # load from extras.py
 
 try:
     import win32api # if we're on a windows machine we can use this module to move the mouse
@@ -40,6 +40,8 @@ win = visual.Window(WINSIZE, units = 'deg', allowGUI=False, fullScr=False, color
 instr = visual.TextStim(win, color=FOREGROUND, pos=[0, 0], height=.8, wrapWidth=20)
 my_mouse = event.Mouse(win = win)
 
+telemetry = Telemetry(rate=50) # samples CPU, memory, I/O and gc pauses in the background
+
 wheel = visual.ElementArrayStim(win, units = 'deg', fieldPos = [0,0], fieldSize = [5,5], fieldShape = 'circle', nElements = 360, sizes = WHEELWIDTH,elementMask = 'circle', elementTex = 'none', texRes = 400, phases = 1)
 
 '''
@@ -54,6 +56,7 @@ comment out line you don't want to use
 colors = hsv2rgb([[i, 1, .8] for i in range(360)]) # creates 360 color values differing in hue and converts them to rgb [-1,1] format
 
 # colors = LAB2RGB(L = 60, a = 20, b = 20, radius = 60) # uses function from extras.py to convert lab to rgb
+# wheel-gamut.py can be used to find the largest wheel that doesn't need trimming
 # note that these colors won't be rendered exactly as intended if the monitor isn't calibrated properly
 # see https://www.ncbi.nlm.nih.gov/pubmed/24715329
 
@@ -197,6 +200,7 @@ def one_trial(N=4, study_time=1, delay=2, isi=.2):
     # get recall responses
     recalled = []
     for r in range(N):
+        telemetry.mark("recall %i" % (r+1))
         recalled.append(get_recall(cue_loc = trial_locs[r]))
         [stim[x].draw() for x in range(len(stim))]
         win.flip()
@@ -224,12 +228,15 @@ def main(n_trials = 30, start_trial_wspace=True):
     col_headers = "id, trial, serial_pos, location, presented, recalled, error\n"
     data_file.write(col_headers)
 
+    telemetry.start(save_path + datestr) # also saves if the session is quit early
     press_key("On each trial you will see a sequence of four colors.\n\nYou will then be asked to recall each color by clicking on a color wheel.\n\nPress SPACE to begin.")
 
     for t in range(n_trials):
         if start_trial_wspace:
             press_key("Press SPACE to begin trial")
+        telemetry.mark("trial %i" % (t+1))
         tdat = one_trial()
+        telemetry.mark("write trial %i" % (t+1))
 
         # write trial data to file
         for i in range(4):
@@ -237,5 +244,8 @@ def main(n_trials = 30, start_trial_wspace=True):
 
     data_file.close()
 
+    telemetry.stop()
+    telemetry.save(save_path + datestr)
+
 
 main(5)
@@ -9,6 +9,7 @@ For another cued recall task, see color-wheel.py
 from psychopy import visual, core, data, event, gui, monitors
 import pandas as pd
 import random, os, string, pickle
+from extras import TextCache, Telemetry # load classes from extras.py
 
 ### SETTINGS
 WINSIZE = [1000, 1000]
@@ -32,11 +33,13 @@ mon.save()
 
 win = visual.Window(WINSIZE, units = 'deg', allowGUI= False, fullScr=True, color=BACKGROUND, monitor=mon)
 
-t_stim = visual.TextStim(win, color=FOREGROUND, pos=[0, -IMWORD_SEP/2.0], height=WORDSIZE_DEG, wrapWidth=25)
+t_cache = TextCache(win, color=FOREGROUND, pos=[0, -IMWORD_SEP/2.0], height=WORDSIZE_DEG, wrapWidth=25) # reuses rendered words instead of re-rendering
+input_stim = visual.TextStim(win, color=FOREGROUND, pos=[0, -IMWORD_SEP/2.0], height=WORDSIZE_DEG, wrapWidth=25) # for typed responses
 i_stim = visual.ImageStim(win, pos=[0, IMWORD_SEP/2.0], size=[IMSIZE_DEG]*2) # alt. SimpleImageStim
 rect = visual.Rect(win, pos=[0,IMWORD_SEP/2.0], width=IMSIZE_DEG, height=IMSIZE_DEG, lineColor=[1,1,1], fillColor=[1,1,1])
 instr = visual.TextStim(win, color=FOREGROUND, pos=[0, 0], height=.8, wrapWidth=20)
 RT = core.Clock()
+telemetry = Telemetry(rate=50) # samples CPU, memory, I/O and gc pauses in the background
 
 ### READ WORDS AND CREATE BLOCK LIST
 def read_words(file):
@@ -72,7 +75,7 @@ def press_key(text = 'Press SPACE to continue', k_list = ['space']):
 def study_pair(image, word, study_time = 2, isi = .5):
 
     i_stim.image = "stimuli/images/" + image
-    t_stim.text = word.upper()
+    t_stim = t_cache.get(word.upper())
 
     rect.draw()
     i_stim.draw()
@@ -97,10 +100,10 @@ def recall_pair(cue_image, correct_word, time_lim = 10, feedback = True, feedbac
     finished = False
     RT.reset()
     while not finished and RT.getTime() <= time_lim:
-        t_stim.text = input
+        t_cache.set_text(input_stim, input) # only re-rendered when a key changes the input
         rect.draw()
         i_stim.draw()
-        t_stim.draw()
+        input_stim.draw()
         win.flip()
 
         n_chars = len(list(input))
@@ -125,25 +128,21 @@ def recall_pair(cue_image, correct_word, time_lim = 10, feedback = True, feedbac
 
     if feedback:
         if correct == 1:
-            t_stim.color = [0,1,0]
-            t_stim.text = recalled.upper()
+            t_stim = t_cache.get(recalled.upper(), color=[0,1,0])
             rect.draw()
             i_stim.draw()
             t_stim.draw()
             win.flip()
             core.wait(feedback_time)
-            t_stim.color = FOREGROUND
         else:
-            t_stim.color = [1,0,0]
-            t_stim.text = recalled.upper()
+            t_stim = t_cache.get(recalled.upper(), color=[1,0,0])
             rect.draw()
             i_stim.draw()
             t_stim.draw()
             win.flip()
             core.wait(feedback_time)
 
-            t_stim.color = FOREGROUND
-            t_stim.text = correct_word.upper()
+            t_stim = t_cache.get(correct_word.upper())
             rect.draw()
             i_stim.draw()
             t_stim.draw()
@@ -186,10 +185,14 @@ def main():
     age =  expInfo["Age"]
     date = expInfo['dateStr']
 
+    file_name = save_path + "p" + str(pNo) + "_" + date
+
     press_key("Press SPACE to start.")
+    telemetry.start(file_name) # also saves if the session is quit early
 
     # study
     for pair in range(NLEARN):
+        telemetry.mark("study %i" % (pair+1))
         study_pair(image=block_list[pair]["image"], word=block_list[pair]["word"])
 
     instr.text = "RECALL"
@@ -202,6 +205,7 @@ def main():
     random.shuffle(recall_order)
     # recall
     for pair in recall_order:
+        telemetry.mark("recall %i" % (pair+1))
         recalled, acc, rt = recall_pair(cue_image=block_list[pair]["image"], correct_word=block_list[pair]["word"])
         # add to dictionary
         block_list[pair]["recall_order"] = recall_order.index(pair) + 1
@@ -211,16 +215,21 @@ def main():
 
     #print(block_list)
 
+    telemetry.mark("export")
     block_list_pd = pd.DataFrame(block_list)
     block_list_pd["pid"] = pNo
     block_list_pd["date"] = date
     block_list_pd["age"] = age
 
-    file_name = save_path + "p" + str(pNo) + "_" + date
-
     block_list_pd.to_csv(file_name + ".csv")
     block_list_pd.to_pickle(file_name + ".pkl")
 
+    telemetry.stop()
+    telemetry.save(file_name)
+
+    t_cache.save(file_name)
+    print("text cache: %(hits)i hits, %(misses)i misses (hit rate %(hit_rate).2f), %(skipped)i unchanged updates skipped, ~%(hit_time_saved).3f + %(skip_time_saved).3f s of rendering saved" % t_cache.stats())
+
 
 if __name__ == '__main__':
     main()
@@ -1,5 +1,40 @@
 
 import numpy as np
+import time, itertools, os, sys, gc, threading, atexit, traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+# reference points and matrices used by lab2rgb_array (and so LAB2RGB)
+REF_XYZ = np.array([95.047, 100.000, 108.883])
+XYZ2RGB = np.array([[3.2406, -1.5372, -0.4986],
+                    [-0.9689, 1.8758, 0.0415],
+                    [0.0557, -0.2040, 1.0570]])
+RGB2XYZ = np.linalg.inv(XYZ2RGB)
+
+def lab2rgb_array(lab):
+    '''
+    converts an array of (..., 3) CIELab values to untrimmed RGB values
+    on a 0-255 scale, so values outside 0-255 are out of gamut. Used by
+    LAB2RGB and wheel_gamut so both check the same conversion.
+    '''
+    lab = np.asarray(lab, dtype=float)
+    var_Y = (lab[..., 0] + 16) / 115.000
+    var_X = lab[..., 1] / 500.000 + var_Y
+    var_Z = var_Y - lab[..., 2] / 200.000
+    var = np.stack([var_X, var_Y, var_Z], axis=-1)
+    var = np.where(var**3 > 0.008856, var**3, (var - 16 / 116.000) / 7.787)
+
+    XYZ = REF_XYZ * var / 100.000
+    var_RGB = XYZ.dot(XYZ2RGB.T)
+
+    # gamma correction to IEC 61966-2-1 standard
+    gamma = 1.055 * (np.maximum(var_RGB, 0.0031308) ** (1 / 2.400)) - 0.055
+    var_RGB = np.where(var_RGB > 0.0031308, gamma, 12.92 * var_RGB)
+    return var_RGB * 255
+
+def trim_rgb(rgb):
+    # trims RGB (0-255) values to the displayable range, rounding those within it
+    return np.where(rgb > 255, 255, np.where(rgb < 0, 0, np.round(rgb)))
 
 def LAB2RGB(L, a, b, radius, rgb = True):
     '''
@@ -7,67 +42,383 @@ def LAB2RGB(L, a, b, radius, rgb = True):
     and radius then converts to RGB values, trimming nonsense values.
     Returns a list of 360 color values.
     '''
-    colours = [] # proper spelling :)
     # create CIELab colours
-    for ang in range(360):
-        theta = ang * np.pi / 180.000 # converts angle to radian
-        A = a + radius*np.cos(theta)
-        B = b + radius*np.sin(theta)
-
-        # Lab to XYZ
-        var_Y = (L + 16) / 115.000
-        var_X = A / 500.000 + var_Y
-        var_Z = var_Y - B / 200.000
-
-        # filter X, Y, Z with threshold 0.008856
-        if  var_Y**3 > 0.008856: var_Y = var_Y**3
-        else: var_Y = ( var_Y - 16 / 116.000 ) / 7.787
-        if var_X**3 > 0.008856: var_X = var_X**3
-        else: var_X = ( var_X - 16 / 116.000 ) / 7.787
-        if var_Z**3 > 0.008856: var_Z = var_Z**3
-        else: var_Z = ( var_Z - 16 / 116.000 ) / 7.787
-
-        # reference points
-        ref_X =  95.047
-        ref_Y = 100.000
-        ref_Z = 108.883
-
-        X = ref_X * var_X / 100.000
-        Y = ref_Y * var_Y / 100.000
-        Z = ref_Z * var_Z / 100.000
-
-        # covert XYZ to RGB
-        var_R = X * 3.2406 + Y * -1.5372 + Z * -0.4986
-        var_G = X * -0.9689 + Y * 1.8758 + Z * 0.0415
-        var_B = X * 0.0557 + Y * -0.2040 + Z * 1.0570
-
-        # gamma correction to IEC 61966-2-1 standard
-        if var_R > 0.0031308: var_R = 1.055 * ( var_R ** ( 1 / 2.400 ) ) - 0.055
-        else: var_R = 12.92 * var_R
-        if var_G > 0.0031308: var_G = 1.055 * ( var_G ** ( 1 / 2.400 ) ) - 0.055
-        else: var_G = 12.92 * var_G
-        if var_B > 0.0031308: var_B = 1.055 * ( var_B ** ( 1 / 2.400 ) ) - 0.055
-        else: var_B = 12.92 * var_B
-
-        # trim
-        if (var_R*255) > 255: R = 255
-        elif (var_R*255) < 0: R = 0
-        else: R = round(var_R*255)
-
-        if (var_G*255) > 255: G = 255
-        elif (var_G*255) < 0: G = 0
-        else: G = round(var_G*255)
-
-        if (var_B*255) > 255: B = 255
-        elif (var_B*255) < 0: B = 0
-        else: B = round(var_B*255)
-
-        if rgb:
-            x = 255.0/2.0
-            R = (R - x)/x
-            G = (G - x)/x
-            B = (B - x)/x
-        colours.append([R,G,B])
-    return np.array(colours)
+    theta = np.arange(360) * np.pi / 180.000 # converts angles to radians
+    lab = np.stack([np.full(360, float(L)), a + radius*np.cos(theta), b + radius*np.sin(theta)], axis=-1)
+
+    # convert to RGB (0-255) and trim
+    colours = lab2rgb_array(lab) # proper spelling :)
+    colours = trim_rgb(colours)
+
+    if rgb:
+        x = 255.0/2.0
+        return (colours - x)/x
+    return colours.astype(int)
 
 #colors = LAB2RGB(L = 50, a = 20, b = 20, radius = 60)
+
+def rgb2lab_array(rgb):
+    '''
+    inverse of lab2rgb_array (RGB on a 0-255 scale to CIELab), used to
+    measure the colors that are actually shown after trimming
+    '''
+    var_RGB = np.asarray(rgb, dtype=float) / 255
+    linear = ((np.maximum(var_RGB, 0) + 0.055) / 1.055) ** 2.400
+    var_RGB = np.where(var_RGB > 12.92 * 0.0031308, linear, var_RGB / 12.92)
+
+    var = var_RGB.dot(RGB2XYZ.T) * 100.000 / REF_XYZ
+    var = np.where(var > 0.008856, np.cbrt(var), var * 7.787 + 16 / 116.000)
+
+    L = var[..., 1] * 115.000 - 16
+    a = (var[..., 0] - var[..., 1]) * 500.000
+    b = (var[..., 1] - var[..., 2]) * 200.000
+    return np.stack([L, a, b], axis=-1)
+
+def wheel_gamut(L, a, b, radii, n = 360):
+    '''
+    checks how well wheels with center (L, a, b) and each of the radii
+    survive the trimming done by LAB2RGB. For each radius returns the
+    number of clipped colors and the delta E (CIE76) between adjacent
+    colors as displayed: min, max and coefficient of variation (sd/mean,
+    0 = perfectly uniform steps).
+    '''
+    radii = np.atleast_1d(np.asarray(radii, dtype=float))
+    theta = np.arange(n) * 2 * np.pi / n
+    lab = np.empty((len(radii), n, 3))
+    lab[..., 0] = L
+    lab[..., 1] = a + radii[:, None] * np.cos(theta)
+    lab[..., 2] = b + radii[:, None] * np.sin(theta)
+
+    rgb = lab2rgb_array(lab)
+    clipped = np.any((rgb > 255) | (rgb < 0), axis=-1).sum(axis=-1)
+    shown = rgb2lab_array(trim_rgb(rgb)) # what LAB2RGB would give
+
+    dE = np.sqrt(((shown - np.roll(shown, -1, axis=1))**2).sum(axis=-1))
+    dE_mean = dE.mean(axis=-1)
+    dE_cv = np.where(dE_mean > 0, dE.std(axis=-1) / np.maximum(dE_mean, 1e-12), np.inf)
+
+    return([{"L": L, "a": a, "b": b, "radius": float(radii[i]),
+             "clipped": int(clipped[i]),
+             "dE_min": float(dE[i].min()), "dE_max": float(dE[i].max()),
+             "dE_cv": float(dE_cv[i])} for i in range(len(radii))])
+
+def _wheel_gamut_center(args):
+    # helper so that ProcessPoolExecutor.map can pass one center at a time
+    return(wheel_gamut(*args))
+
+def find_wheel(L_range = range(30, 85, 5), a_range = range(-30, 35, 5), b_range = range(-30, 35, 5), radii = range(10, 81), n = 360, max_workers = None):
+    '''
+    searches a grid of wheel centers and radii (spread across a pool of
+    processes) and returns the largest wheel with no clipped colors
+    (ties broken by the most uniform delta E) along with the results for
+    every candidate. Call this from inside if __name__ == '__main__':
+    as it starts new processes (see wheel-gamut.py).
+    '''
+    radii = list(radii)
+    centers = [(L, a, b, radii, n) for L, a, b in itertools.product(L_range, a_range, b_range)]
+
+    results = []
+    with ProcessPoolExecutor(max_workers = max_workers) as pool:
+        for res in pool.map(_wheel_gamut_center, centers, chunksize = max(1, len(centers) // 64)):
+            results.extend(res)
+
+    in_gamut = [r for r in results if r["clipped"] == 0]
+    if len(in_gamut) == 0:
+        return(None, results)
+    best = max(in_gamut, key = lambda r: (r["radius"], -r["dE_cv"]))
+    return(best, results)
+
+
+class TextCache(object):
+    '''
+    keeps one TextStim for each (text, color, height) combination so
+    that words shown more than once are not re-laid out and re-rendered
+    every time they are drawn. Any other TextStim arguments (pos,
+    wrapWidth...) are shared by all stimuli in the cache. Use get() in
+    place of setting stim.text, set_text() for a stimulus that changes
+    often (e.g. typed input) and stats() to see how many renders were
+    avoided.
+    '''
+    def __init__(self, win, color=(-1,-1,-1), height=1, max_size=500, **kwargs):
+        from psychopy import visual # only needed here, keeps LAB2RGB psychopy-free
+        self._visual = visual
+        self.win = win
+        self.color = color
+        self.height = height
+        self.max_size = max_size
+        self.kwargs = kwargs
+        self._stims = OrderedDict() # oldest first, so we can drop it when full
+        self.hits = 0 # get() found the stimulus already rendered
+        self.misses = 0 # get() had to build a new stimulus
+        self.build_time = 0.0 # total seconds spent building stimuli on misses
+        self.updates = 0 # set_text() changed the text
+        self.skipped = 0 # set_text() was given the text already shown
+        self.update_time = 0.0 # total seconds spent re-rendering on updates
+
+    def get(self, text, color=None, height=None):
+        if color is None:
+            color = self.color
+        if height is None:
+            height = self.height
+        key = (text, tuple(color), height)
+
+        stim = self._stims.get(key)
+        if stim is not None:
+            self.hits += 1
+            self._stims.move_to_end(key)
+            return(stim)
+
+        self.misses += 1
+        start = time.perf_counter()
+        stim = self._visual.TextStim(self.win, text=text, color=color, height=height, **self.kwargs)
+        self.build_time += time.perf_counter() - start
+
+        self._stims[key] = stim
+        if self.max_size is not None and len(self._stims) > self.max_size:
+            self._stims.popitem(last=False)
+        return(stim)
+
+    def set_text(self, stim, text):
+        # only re-render if the text has changed
+        if stim.text == text:
+            self.skipped += 1
+            return(stim)
+        self.updates += 1
+        start = time.perf_counter()
+        stim.text = text
+        self.update_time += time.perf_counter() - start
+        return(stim)
+
+    def stats(self):
+        '''
+        time saved is estimated from the average text update, as that is
+        what a hit or a skip avoids compared to setting stim.text. If there
+        were no updates the average build is used instead (an upper bound,
+        as building also creates the stimulus).
+        '''
+        lookups = self.hits + self.misses
+        if self.updates:
+            mean_render = self.update_time / self.updates
+        elif self.misses:
+            mean_render = self.build_time / self.misses
+        else:
+            mean_render = 0.0
+        return({"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / float(lookups) if lookups else 0.0,
+                "build_time": self.build_time,
+                "hit_time_saved": self.hits * mean_render,
+                "updates": self.updates,
+                "skipped": self.skipped,
+                "update_time": self.update_time,
+                "skip_time_saved": self.skipped * mean_render})
+
+    def save(self, file_name):
+        # writes stats() to file_name + "_textcache.csv" (one row per session)
+        stats = self.stats()
+        cols = ["hits", "misses", "hit_rate", "build_time", "hit_time_saved", "updates", "skipped", "update_time", "skip_time_saved"]
+        stats_file = open(file_name + "_textcache.csv", "w")
+        stats_file.write(", ".join(cols) + "\n")
+        stats_file.write(", ".join(str(stats[c]) for c in cols) + "\n")
+        stats_file.close()
+
+
+class Telemetry(object):
+    '''
+    samples system load in a background thread so that timing hiccups
+    can be matched up with what the machine was doing at the time.
+    Each sample holds system CPU use, I/O wait, this process's CPU use,
+    resident memory, bytes read/written and time spent in garbage
+    collection since the previous sample. Values are read from /proc,
+    so on Windows/Mac only the garbage collection columns are filled.
+    Samples go into a buffer that is allocated up front (the oldest are
+    overwritten when it is full). Call mark() at points of interest in
+    the experiment (e.g. trial start) and save() once the session is over.
+    If start() is given a file name, the data are also saved if the
+    experiment quits early (e.g. core.quit()).
+    '''
+    COLUMNS = ["time", "cpu", "iowait", "proc_cpu", "rss_mb", "read_kb", "write_kb", "gc_ms", "gc_n"]
+
+    def __init__(self, rate=50, max_samples=200000, max_markers=10000, max_gc=100000):
+        self.interval = 1.0 / rate
+        self.t0 = time.perf_counter()
+        self.samples = np.zeros((max_samples, len(self.COLUMNS)))
+        self.n_samples = 0
+        self.marker_times = np.zeros(max_markers)
+        self.marker_labels = [None] * max_markers
+        self.n_markers = 0
+        self.gc_pauses = np.zeros((max_gc, 3)) # start time, duration (ms), generation
+        self.n_gc = 0
+        self._gc_start = None
+        self._gc_ms = 0.0 # running totals, only written by _on_gc
+        self._gc_n = 0
+        self._lock = threading.RLock() # reentrant as gc can start while we hold it
+        self._stop = threading.Event()
+        self._thread = None
+        self.file_name = None
+        self.error = None # traceback if sampling stopped unexpectedly
+        self._ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self._page_mb = (os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096) / 1048576.0
+
+    def start(self, file_name=None):
+        if self._thread is not None and self._thread.is_alive():
+            raise(Warning("in Telemetry.start - already started"))
+        if self._thread is None:
+            self.t0 = time.perf_counter() # keep the first start as time 0 if restarted (e.g. per block)
+        if file_name is not None:
+            self.file_name = file_name
+            atexit.unregister(self._save_at_exit) # only register once
+            atexit.register(self._save_at_exit)
+        self._stop.clear()
+        if self._on_gc not in gc.callbacks:
+            gc.callbacks.append(self._on_gc)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True # don't keep the experiment open if stop() isn't called
+        self._thread.start()
+        self.mark("telemetry_start")
+
+    def stop(self):
+        # remove the gc callback even if sampling has already stopped (e.g. after an error)
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self.mark("telemetry_stop")
+        self._stop.set()
+        self._thread.join()
+
+    def _save_at_exit(self):
+        # registered with atexit by start() so an aborted session still gets saved
+        self.stop()
+        self.save(self.file_name)
+
+    def mark(self, label):
+        # called from the experiment, so keep this as cheap as possible
+        t = time.perf_counter()
+        with self._lock:
+            i = self.n_markers % len(self.marker_labels)
+            self.n_markers += 1
+            self.marker_times[i] = t
+            self.marker_labels[i] = label
+
+    def _on_gc(self, phase, info):
+        # gc runs on whichever thread triggered it, usually the one drawing the stimuli
+        if phase == "start":
+            self._gc_start = time.perf_counter()
+        elif self._gc_start is not None:
+            duration = (time.perf_counter() - self._gc_start) * 1000
+            self._gc_ms += duration
+            self._gc_n += 1
+            with self._lock:
+                self.gc_pauses[self.n_gc % len(self.gc_pauses)] = (self._gc_start, duration, info["generation"])
+                self.n_gc += 1
+            self._gc_start = None
+
+    def _open(self, path):
+        try:
+            return(open(path, "r"))
+        except (IOError, OSError): # no /proc (not linux) or not allowed to read it
+            return(None)
+
+    def _read(self, f):
+        if f is None:
+            return(None)
+        f.seek(0)
+        return(f.read())
+
+    def _run(self):
+        files = [self._open(path) for path in ("/proc/stat", "/proc/self/stat", "/proc/self/statm", "/proc/self/io")]
+        try:
+            self._sample(*files)
+        except Exception:
+            # don't lose the failure in the background thread
+            self.error = traceback.format_exc()
+            self.mark("telemetry_error")
+            sys.stderr.write("Telemetry stopped sampling:\n" + self.error)
+        finally:
+            for f in files:
+                if f is not None:
+                    f.close()
+
+    def _sample(self, stat_f, proc_f, mem_f, io_f):
+        last = None
+        gc_ms, gc_n = self._gc_ms, self._gc_n # totals carry over if restarted
+        while not self._stop.is_set():
+            t = time.perf_counter()
+            row = self.samples[self.n_samples % len(self.samples)] # a view, so we fill the buffer in place
+            row[:] = np.nan
+            row[0] = t
+
+            cpu = self._read(stat_f)
+            if cpu is not None:
+                # only the first 8 fields, guest time is already counted in user/nice
+                cpu = [float(x) for x in cpu.split("\n", 1)[0].split()[1:9]]
+                total, idle, iowait = sum(cpu), cpu[3], cpu[4]
+            proc = self._read(proc_f)
+            if proc is not None:
+                fields = proc.rsplit(")", 1)[1].split() # skip the process name, it may contain spaces
+                proc = (float(fields[11]) + float(fields[12])) / self._ticks # utime + stime
+            mem = self._read(mem_f)
+            if mem is not None:
+                row[4] = float(mem.split()[1]) * self._page_mb
+            io = self._read(io_f)
+            if io is not None:
+                io = dict(line.split(":", 1) for line in io.strip().split("\n") if ":" in line)
+                io = (float(io["read_bytes"]), float(io["write_bytes"]))
+
+            if last is not None:
+                l_t, l_cpu, l_proc, l_io = last
+                if cpu is not None and total > l_cpu[0]:
+                    row[1] = 1 - (idle - l_cpu[1] + iowait - l_cpu[2]) / (total - l_cpu[0])
+                    row[2] = (iowait - l_cpu[2]) / (total - l_cpu[0])
+                if proc is not None:
+                    row[3] = (proc - l_proc) / (t - l_t)
+                if io is not None:
+                    row[5] = (io[0] - l_io[0]) / 1024
+                    row[6] = (io[1] - l_io[1]) / 1024
+            last = (t, (total, idle, iowait) if cpu is not None else None, proc, io)
+
+            row[7] = self._gc_ms - gc_ms
+            row[8] = self._gc_n - gc_n
+            gc_ms, gc_n = row[7] + gc_ms, row[8] + gc_n
+
+            self.n_samples += 1
+            self._stop.wait(self.interval)
+
+    def _ordered(self, values, n):
+        # unwrap a ring buffer so the oldest entry comes first
+        size = len(values)
+        if n <= size:
+            return(list(range(n)))
+        return([(n + i) % size for i in range(size)])
+
+    def save(self, file_name):
+        '''
+        writes file_name + "_telemetry.csv" (one row per sample, with the
+        last marker before it) and file_name + "_events.csv" (markers and
+        gc pauses). Times are in seconds from start().
+        '''
+        atexit.unregister(self._save_at_exit) # saved now, no need to save again at exit
+        t0 = self.t0
+        markers = [(self.marker_times[i], self.marker_labels[i]) for i in self._ordered(self.marker_labels, self.n_markers)]
+        events = [(t, label, "NA", "NA") for t, label in markers]
+        for i in self._ordered(self.gc_pauses, self.n_gc):
+            events.append((self.gc_pauses[i, 0], "gc", "%.3f" % self.gc_pauses[i, 1], "%i" % self.gc_pauses[i, 2]))
+        events.sort(key=lambda e: e[0])
+
+        events_file = open(file_name + "_events.csv", "w")
+        events_file.write("time, event, duration_ms, generation\n")
+        for t, label, duration, generation in events:
+            events_file.write("%.6f, %s, %s, %s\n" % (t - t0, label, duration, generation))
+        events_file.close()
+
+        m = 0
+        samples_file = open(file_name + "_telemetry.csv", "w")
+        samples_file.write(", ".join(self.COLUMNS + ["marker"]) + "\n")
+        for i in self._ordered(self.samples, self.n_samples):
+            row = self.samples[i]
+            while m < len(markers) and markers[m][0] <= row[0]:
+                m += 1
+            marker = markers[m - 1][1] if m > 0 else "NA"
+            samples_file.write("%.6f, " % (row[0] - t0) + ", ".join("NA" if np.isnan(x) else "%.4f" % x for x in row[1:]) + ", %s\n" % marker)
+        samples_file.close()
@@ -8,6 +8,7 @@ Response is old-new button press followed by confidence rating 1-3.
 from psychopy import visual, monitors, core, data, event, gui
 import random, os, csv
 import pandas as pd
+from extras import TextCache # load class from extras.py
 
 ### SETTINGS
 WINSIZE = [1000, 1000] # window size in pixels
@@ -25,6 +26,7 @@ mon.save()
 win = visual.Window(WINSIZE, units = 'deg', allowGUI=False, fullScr=True, color=BACKGROUND, monitor=mon)
 
 text_stim = visual.TextStim(win, color=FOREGROUND, pos=[0,0], height=1, wrapWidth=25)
+word_cache = TextCache(win, color=FOREGROUND, pos=[0,0], height=1, wrapWidth=25) # words (and the fixation cross) are shown more than once, so reuse them
 conf_scale = visual.RatingScale(win, low=1, high=3, singleClick=True, showAccept=False, labels=('Low','Med','High'), scale='How confident are you?', pos=[0,0])
 
 RT = core.Clock()
@@ -90,13 +92,11 @@ def study_proc(study_list, pres_time = 2, isi = .5):
     win.flip()
     core.wait(1)
     for item in study_list:
-        text_stim.text = item["word"].upper()
-        text_stim.draw()
+        word_cache.get(item["word"].upper()).draw()
         win.flip() # present the word for the presentation time
         core.wait(pres_time)
 
-        text_stim.text = "+"
-        text_stim.draw()
+        word_cache.get("+").draw()
         win.flip() # present a fixation cross for the isi
         core.wait(isi)
 
@@ -105,8 +105,7 @@ def test_proc(test_list):
     press_key("'O' = old\n'N' = new\n\nPress SPACE to start")
     # loop through the test list
     for item in test_list:
-        text_stim.text = item["word"].upper()
-        text_stim.draw()
+        word_cache.get(item["word"].upper()).draw() # already rendered if it was studied
         win.flip() # present probe word
 
         RT.reset() # start counting for RT
@@ -158,7 +157,11 @@ def main():
     test_data_pd["age"] = expInfo["Age"]
 
     # use pandas to write data to csv file
-    test_data_pd.to_csv(save_path + "p" + str(expInfo["Participant"]) + "_" + expInfo["dateStr"] + ".csv")
+    file_name = save_path + "p" + str(expInfo["Participant"]) + "_" + expInfo["dateStr"]
+    test_data_pd.to_csv(file_name + ".csv")
+
+    word_cache.save(file_name)
+    print("text cache: %(hits)i hits, %(misses)i misses (hit rate %(hit_rate).2f), %(skipped)i unchanged updates skipped, ~%(hit_time_saved).3f + %(skip_time_saved).3f s of rendering saved" % word_cache.stats())
 
 
 if __name__ == '__main__':
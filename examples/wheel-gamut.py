@@ -0,0 +1,32 @@
+'''
+Color wheel gamut search:
+
+LAB2RGB (in extras.py) trims colors that fall outside the RGB gamut,
+which makes some wheels less perceptually uniform than intended.
+This script checks a grid of wheel centers and radii and reports the
+largest wheel that can be shown without trimming.
+The result can be used in color-wheel.py.
+'''
+
+from extras import find_wheel # load function from extras.py
+
+### SETTINGS
+L_RANGE = range(30, 85, 5)
+A_RANGE = range(-30, 35, 5)
+B_RANGE = range(-30, 35, 5)
+RADII = range(10, 81)
+
+def main():
+    best, results = find_wheel(L_range=L_RANGE, a_range=A_RANGE, b_range=B_RANGE, radii=RADII)
+
+    print("checked %i wheels, %i without clipping" % (len(results), len([r for r in results if r["clipped"] == 0])))
+    if best is None:
+        print("no wheel stays within gamut, try smaller radii")
+    else:
+        print("largest wheel: L = %(L)i, a = %(a)i, b = %(b)i, radius = %(radius)i" % best)
+        print("delta E between adjacent colors: min = %(dE_min).3f, max = %(dE_max).3f, cv = %(dE_cv).3f" % best)
+        print("use with: colors = LAB2RGB(L = %(L)i, a = %(a)i, b = %(b)i, radius = %(radius)i)" % best)
+
+
+if __name__ == '__main__': # needed as find_wheel starts new processes
+    main()